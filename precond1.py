@@ -94,17 +94,13 @@ time = data[:,1] + data[:,2]/24.
 clock = (180.0/np.pi)*np.arctan2(data[:,5], data[:,6])
 
 # Finally, we extract values between epoch minus 24 hours through epoch.
-# Here, we do this is a very clunky way and will improve upon it in
-# future iterations.  Let's loop through the times and find the indexes
-# where time is within epoch and epoch minus 1 day.
-iStart, iStop = -1, -1  # Initial values of our indices.
-for i, tnow in enumerate(time):  # Python loops are cool.
-    # If the current time surpasses epoch-1 for the first time, get index.
-    if tnow >= epoch-1.0 and iStart==-1: iStart=i
-    # If we pass epoch, save index and break.
-    if tnow > epoch:
-        iStop = i
-        break
+# Because our times are sorted, we don't need to loop through all of them.
+# Numpy's `searchsorted` finds where a value would be inserted into a
+# sorted array using a fast binary search.  That's exactly the index we want!
+# iStart is the first time at or after epoch-1; iStop is the first time
+# after epoch.
+iStart = np.searchsorted(time, epoch-1.0, side='left')
+iStop  = np.searchsorted(time, epoch,     side='right')
 
 # DEBUG INFORMATION:  Let's print to screen what we found in
 # our time analysis above.  See notes on "format" syntax below.
@@ -113,8 +109,13 @@ print('Epoch is DOY {} Hour {:.1f}'.format(
     int(epoch), 24*(epoch-int(epoch))))
 print('Start time: i={}, DOY {} Hour {:.1f}'.format(
     iStart, int(time[iStart]), 24*(time[iStart]-int(time[iStart]))))
-print('End time: i={}, DOY {} Hour {:.1f}'.format(
-    iStop, int(time[iStop]), 24*(time[iStop]-int(time[iStop]))))
+# If no record comes after epoch, iStop is one past the end of our data,
+# so there's no time to print there.
+if iStop < time.size:
+    print('End time: i={}, DOY {} Hour {:.1f}'.format(
+        iStop, int(time[iStop]), 24*(time[iStop]-int(time[iStop]))))
+else:
+    print('End time: i={}, end of file'.format(iStop))
     
 # Report values to screen and quit.
 # `.mean` does the averaging.  The indexing handles controlling the range.
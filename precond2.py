@@ -21,14 +21,34 @@ DTW, 2020, GEM Student Tutorial
 '''
 
 # Always start with imports at the top!
+import os
+import mmap
 import datetime as dt
 import numpy as np
+import numpy.lib.recfunctions as rfn
+
+# Because we assume the layout of our file, the variable list can be
+# hard coded.  This is a major limitation...
+varnames = ['b', 'bx', 'by', 'bz', 'dens', 'v', 'pdyn', 'dst']
+
+# Along with time, each record will also hold the clock angle.  These are
+# all of the values that we can average:
+fieldnames = varnames + ['clock']
+
+# Our data will be stored in a Numpy "structured array".  Each record
+# (one hour of data) holds a time and all of the values above.
+# This `dtype` describes the name and type of each field in a record:
+omni_dtype = np.dtype([('time', 'datetime64[h]')] +
+                      [(v, np.float64) for v in fieldnames])
+
+# Conversion factor from radians to degrees:
+r2d = 180.0/np.pi
 
 #### Function definitions:
-def load_omni(filename):
+def load_omni(filename, stop=None):
     '''
     Read a *.lst file obtained from https://omniweb.gsfc.nasa.gov/form/dx1.html.
-    Return a dictionary of values where each value is a numpy array.
+    Return a numpy structured array with one record per line of the file.
 
     Data is assumed to be regularly spaced in time.
     File must have the following variables in this order: 
@@ -52,72 +72,112 @@ def load_omni(filename):
 
     Other Parameters
     ================
+    stop : datetime or numpy datetime64
+       If given, only read records up to and including this time.  The rest
+       of the file is skipped entirely.  Defaults to None (read everything).
 
     Returns
     =======
-    data : dict
-        A dictionary of numpy vectors containing the parsed data.
+    data : numpy structured array
+        The parsed data, with fields described by `omni_dtype`.  Each field
+        can be accessed by name, like a dictionary.  Time is stored under
+        'time' as a numpy datetime64 with hourly precision.  The 'clock'
+        field is filled with NaN until calc_clock is called.
 
     Examples
     ========
     >>> data = load_omni('data/omni_test.py')
-    >>> data.keys()
+    >>> data.dtype.names
     >>> data['bx']
 
     '''
 
-    # Because we assume the layout of our file, the variable list can be
-    # hard coded.  This is a major limitation...
-    varnames = ['b', 'bx', 'by', 'bz', 'dens', 'v', 'pdyn', 'dst']
-    
-    # Open file and slurp in contents using "with" statement.
-    with open(filename,'r') as f:
-        lines = f.readlines()
-
-    # Get number of records in the file:
-    nRec = len(lines)
-
-    # Create a container to hold the data.  We'll use a dictionary, which
-    # is an associative array in Python.  Each "key" will be the variable
-    # name (as we define above in `varnames`) and each "value" will be a
-    # numpy array with the correct number of records.
-    data = {} # Empty dict.
-    for v in varnames:
-        data[v] = np.zeros(nRec)
-    # We're using datetimes, so the numpy array for time is a bit special.
-    data['time'] = np.zeros(nRec, dtype=object)
-
-    # Now, read the file.  Loop over all lines, keeping track of the
-    # line number.
-    for i, l in enumerate(lines):
-        
-        # Break the line into parts based on whitespace:
-        parts = l.split()
-
-        # For time, we want to create datetimes instead of DOY.HH floats.
-        # We have Year, DOY, and Hour in the file.  We'll turn that into
-        # a date time by creating a datetime of the year and adding the
-        # days and hours to that.
-        data['time'][i] = dt.datetime(int(parts[0]), 1, 1, 0, 0) + \
-                          dt.timedelta(days=int(parts[1])-1, hours=int(parts[2]))
-
-        # The rest of the values can just be stuffed into the right spot in
-        # the dictionary!
-        for j, v in enumerate(varnames):
-            data[v][i] = parts[j+3]
-
-    # Return the dictionary to the caller:
+    # Open the file as a "memory map".  The operating system lets us look
+    # at the file directly and only loads the parts we actually touch, so
+    # finding where to stop reading (see below) is cheap.  The records we
+    # keep are still copied once before Numpy parses them.
+    # The "with" statement closes everything for us when we're done.
+    with open(filename, 'rb') as f:
+        # An empty file can't be memory mapped, and has no data anyway:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.empty(0, dtype=omni_dtype)
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # By default, we'll read the whole file.
+            iEnd = len(mm)
+
+            # If we have a stop time, there's no need to read anything after
+            # it.  Because the file is sorted in time, we can find where to
+            # stop with a "binary search": look at the record in the middle,
+            # then throw away the half of the file that can't contain our
+            # answer, and repeat.  We only ever look at a handful of lines!
+            # Records are compared as (Year, DOY, Hour) tuples.
+            if stop is not None:
+                tStop = np.datetime64(stop, 'h').astype(dt.datetime)
+                key = (tStop.year, tStop.timetuple().tm_yday, tStop.hour)
+                lo, hi = 0, len(mm)
+                while lo < hi:
+                    # Find the line that contains the middle of our range:
+                    mid = (lo+hi)//2
+                    start = mm.rfind(b'\n', lo, mid) + 1 or lo
+                    end = mm.find(b'\n', start) + 1 or len(mm)
+                    record = tuple(int(x) for x in mm[start:end].split()[:3])
+                    # Keep the half that holds the first record after stop:
+                    if record > key:
+                        hi = start
+                    else:
+                        lo = end
+                iEnd = lo
+
+            # Let Numpy parse the file for us in one go.  `fromstring`
+            # treats the file as one long list of numbers separated by
+            # whitespace (newlines included) and does the string-to-number
+            # conversion in compiled code, which is far faster than looping
+            # over lines in Python.  It needs a bytes object, so the part
+            # of the file we keep is copied out of the memory map here.
+            # (Pandas' `read_csv` is another fast option, but Numpy is our
+            # only dependency and is plenty fast for hourly OMNI files.)
+            raw = np.fromstring(mm[:iEnd], sep=' ', dtype=np.float64)
+
+    # Our numbers come out in the same order as the file: one record
+    # after another.  Reshape them into a 2D array with one row per
+    # record and one column per variable.
+    raw = raw.reshape(-1, 3+len(varnames))
+
+    # Create a container to hold the data.  We'll use a structured array
+    # (see `omni_dtype` above), which keeps each record together in memory
+    # but lets us get to each variable by name, just like a dictionary.
+    data = np.empty(raw.shape[0], dtype=omni_dtype)
+
+    # For time, we want to create datetimes instead of DOY.HH floats.
+    # We have Year, DOY, and Hour in the first three columns.  We'll turn
+    # that into a time by creating a Numpy datetime64 of the year and adding
+    # the days and hours to that.  Because we do this with whole arrays at
+    # once, there's no need to loop over every record!
+    year, doy, hour = raw[:, 0:3].T.astype(np.int32)
+    data['time'] = (year-1970).astype('datetime64[Y]') + \
+                   (doy-1).astype('timedelta64[D]') + \
+                   hour.astype('timedelta64[h]')
+
+    # The rest of the values can just be stuffed into the right field:
+    for j, v in enumerate(varnames):
+        data[v] = raw[:, j+3]
+
+    # Clock angle isn't in the file; calc_clock will fill it in.
+    data['clock'] = np.nan
+
+    # Return the data to the caller:
     return data
         
 def calc_clock(data):
     '''
-    Given a dictionary of values produced by load_omni, calculate the
-    IMF clock angle and add to the dictionary.
+    Given solar wind data produced by load_omni, calculate the
+    IMF clock angle and store it in the 'clock' field.
 
     Parameters
     ==========
-    data : dict
-       Dictionary of solar wind values as given by the load_omni function.
+    data : numpy structured array
+       Solar wind values as given by the load_omni function.
 
     Other Parameters
     ================
@@ -135,7 +195,91 @@ def calc_clock(data):
     '''
 
     # See precond1.py for details on this calculation.
-    data['clock'] = (180.0/np.pi)*np.arctan2(data['bz'], data['by'])
+    # Here, we ask Numpy to write its results directly into the 'clock'
+    # field (the `out` keyword).  This avoids creating temporary arrays
+    # for each step of the calculation.
+    clock = data['clock']
+    np.arctan2(data['bz'], data['by'], out=clock)
+    np.multiply(clock, r2d, out=clock)
+
+def windowed_means(values, time, tStart, tEnd):
+    '''
+    Average values over all times between tStart and tEnd (inclusive).
+    If tStart and tEnd are arrays, average over each of those windows.
+
+    Parameters
+    ==========
+    values : numpy array
+       Values to average.  Can be 1D (one value per time) or 2D with one
+       row per variable.
+    time : numpy datetime64 array
+       Sorted times that correspond to the last axis of `values`.
+    tStart, tEnd : numpy datetime64 or array of numpy datetime64
+       Start and end of the window(s) to average over.
+
+    Other Parameters
+    ================
+
+    Returns
+    =======
+    means : numpy array or float
+       The mean of each row of `values` within the window.  For many
+       windows, the last axis has one entry per window.  Windows that
+       contain no data give NaN.
+
+    Examples
+    ========
+    >>> import numpy as np
+    >>> data = load_omni('data/omni_test.lst')
+    >>> tEnd = np.datetime64('2000-07-15T13')
+    >>> windowed_means(data['b'], data['time'], tEnd-np.timedelta64(24,'h'), tEnd)
+    np.float64(3.5)
+
+    '''
+
+    # Under the hood, datetime64 values are just whole numbers (here,
+    # hours since 1970).  Put our window edges in the same units as `time`,
+    # rounding the start up and the end down so that no time outside of
+    # the window sneaks in.  Then we can compare plain integers instead of
+    # asking Numpy to convert `time` to the units of our window edges.
+    lo = np.asarray(tStart).astype(time.dtype)
+    lo = lo + (lo < tStart)
+    hi = np.asarray(tEnd).astype(time.dtype)
+
+    # Because our times are sorted, Numpy's `searchsorted` can find the
+    # first and last indices of the window with a fast binary search.
+    # This works for a single window or for many windows at once.
+    tInt = time.view(np.int64)
+    iStart = np.searchsorted(tInt, lo.view(np.int64), side='left')
+    iStop  = np.searchsorted(tInt, hi.view(np.int64), side='right')
+
+    # Only one window?  Slicing with "start:stop" doesn't copy the data,
+    # it's just a new way of looking at the same values.  Averaging over the
+    # last axis (time) gets the mean of every variable in one go.
+    if np.ndim(iStart) == 0:
+        return values[..., iStart:iStop].mean(axis=-1)
+
+    # With no data at all, every window is empty:
+    nRec = time.size
+    if nRec == 0:
+        return np.full(values.shape[:-1] + iStart.shape, np.nan)
+
+    # For many windows, `np.add.reduceat` sums between pairs of indices.
+    # Interleaving our start and stop indices, every other result is the
+    # sum over one of our windows, all done in a single call.
+    # `reduceat` can't use an index past the end of the data, so we
+    # clip to the last record and add it back in where it was left out.
+    bounds = np.empty(2*iStart.size, dtype=np.intp)
+    bounds[0::2], bounds[1::2] = iStart, iStop
+    np.minimum(bounds, nRec-1, out=bounds)
+    sums = np.add.reduceat(values, bounds, axis=-1)[..., ::2]
+    sums[..., (iStop==nRec) & (iStart<nRec-1)] += values[..., -1:]
+
+    # Divide by the number of points in each window, leaving NaN where
+    # a window is empty:
+    counts = iStop - iStart
+    return np.divide(sums, counts, out=np.full_like(sums, np.nan),
+                     where=counts>0)
 
 def get_precond(filename, epoch, span=24, debug=False):
     '''
@@ -143,15 +287,22 @@ def get_precond(filename, epoch, span=24, debug=False):
     find the mean solar wind characteristics for the time leading up to it.
     Parameters
     ==========
-    data : dict
-       Dictionary of solar wind values as given by the load_omni function.
+    filename : string
+       Path/name of file to load.
+    epoch : datetime
+       The start time of the storm.
 
     Other Parameters
     ================
+    span : int
+       Number of hours before epoch to average over.  Defaults to 24.
+    debug : bool
+       Print extra information to screen.  Defaults to False.
 
     Returns
     =======
-    None
+    means : dict
+       A dictionary of the mean of each variable over the window.
 
     Examples
     ========
@@ -162,28 +313,27 @@ def get_precond(filename, epoch, span=24, debug=False):
     {'b': 12.5, 'bx': 1.5, 'by': 1.0, 'bz': 0.5, 'dens': 0.5, 'v': 12.5, 'pdyn': 610.0, 'dst': 9.3, 'clock': 22.5}
     '''
 
-    # Open file, load data:
-    data = load_omni(filename)
+    # Open file, load data.  Nothing after epoch is needed, so we
+    # don't bother reading it:
+    data = load_omni(filename, stop=epoch)
 
     # Calculate clock angle:
     calc_clock(data)
 
-    # Now, let's get to work.  We want to create a mask
-    # that hides times not within our window.  Numpy can
-    # do this very easily!  "mask" will be an array of
-    # booleans that has the same time and shape as data['time'].
-    # However, it will only be `True` when the conditions pass:
-    mask = (data['time']>=epoch-dt.timedelta(hours=span))&(data['time']<=epoch)
-    
-    # Create a container of output:
-    means = {}
-    
-    # Now, we can get means for all values using this mask:
-    for varname in data.keys():
-        # Don't average time, of course.
-        if varname=='time': continue
-        # Note how we use the boolean array to index our data:
-        means[varname] = data[varname][mask].mean()
+    # Now, let's get to work.  We want to average the part of our data
+    # that falls within our window.  We convert our window edges to Numpy
+    # datetime64 values so that they match data['time']:
+    tEnd   = np.datetime64(epoch)
+    tStart = tEnd - np.timedelta64(span, 'h')
+
+    # Average every variable at once.  `structured_to_unstructured` lets us
+    # look at our variables as a 2D array with one column per variable;
+    # we flip it (transpose) so that time is along the last axis.
+    # Then, pair each mean with its variable name.  We only use the fields
+    # listed in `fieldnames`, so time is never included:
+    values = rfn.structured_to_unstructured(data[fieldnames]).T
+    means = dict(zip(fieldnames,
+                     windowed_means(values, data['time'], tStart, tEnd)))
 
     # Some debug work.  Note the use of "f-strings": formatted
     # strings that begin with f before the quotes.
@@ -192,13 +342,72 @@ def get_precond(filename, epoch, span=24, debug=False):
         print(f'DEBUG INFO:')
         print(f'\tFilename = {filename}')
         print(f'\tEpoch = {epoch:%Y-%m-%d %H UT}')
-        print(f'\tStart time = {data["time"][mask][ 0]:%Y-%m-%d %H UT}')
-        print(f'\tEnd time   = {data["time"][mask][-1]:%Y-%m-%d %H UT}')
+        # Numpy's datetime64 values don't understand these format codes,
+        # so we convert them back into Python datetimes for printing.
+        window = (data['time']>=tStart) & (data['time']<=tEnd)
+        tFirst, tLast = data['time'][window][[0,-1]].astype(dt.datetime)
+        print(f'\tStart time = {tFirst:%Y-%m-%d %H UT}')
+        print(f'\tEnd time   = {tLast:%Y-%m-%d %H UT}')
               
         
     # And that's it!
     return means
 
+def get_preconds(filename, epochs, span=24):
+    '''
+    For a OMNIweb hourly data file and the epochs of many geomagnetic storms,
+    find the mean solar wind characteristics for the time leading up to
+    each of them.  This is the same as calling get_precond for each epoch,
+    but the file is only read once and all windows are averaged together.
+
+    Parameters
+    ==========
+    filename : string
+       Path/name of file to load.
+    epochs : list of datetimes or numpy datetime64 array
+       The start times of the storms.  Must not contain NaT ("not a time").
+
+    Other Parameters
+    ================
+    span : int
+       Number of hours before each epoch to average over.  Defaults to 24.
+
+    Returns
+    =======
+    means : dict
+       A dictionary of numpy arrays, with one mean value per epoch in the
+       same order as `epochs`.
+
+    Examples
+    ========
+    >>> import datetime as dt
+    >>> epochs = [dt.datetime(2000,7,14,13,0,0), dt.datetime(2000,7,15,13,0,0)]
+    >>> means = get_preconds('data/omni_test.lst', epochs)
+    >>> means['b']
+    array([1.5, 3.5])
+    '''
+
+    # Turn our epochs into arrays of window edges:
+    tEnd   = np.asarray(epochs, dtype='datetime64[us]')
+    tStart = tEnd - np.timedelta64(span, 'h')
+
+    # "Not a time" (NaT) values can't be used as window edges:
+    if np.isnat(tEnd).any():
+        raise ValueError('epochs must not contain NaT')
+
+    # Open file, load data up to the last epoch, calculate clock angle.
+    # With no epochs, there's no last epoch, so we read everything:
+    stop = tEnd.max() if tEnd.size else None
+    data = load_omni(filename, stop=stop)
+    calc_clock(data)
+
+    # Average all variables over all windows:
+    values = rfn.structured_to_unstructured(data[fieldnames]).T
+    means = dict(zip(fieldnames,
+                     windowed_means(values, data['time'], tStart, tEnd)))
+
+    return means
+
 if __name__ == '__main__':
     # If we run this file as a script, execute this portion.
     # If we import this file and use it as an API, this part
@@ -16,9 +16,10 @@ and are well liked by the community, but we don't need anything too fancy here.
 '''
 
 import unittest
+import tempfile
 import datetime as dt
-from numpy import array
-from numpy.testing import assert_array_equal
+from numpy import array, datetime64, timedelta64, isnan
+from numpy.testing import assert_array_equal, assert_allclose
 import precond2
 
 class TestLoadOmni(unittest.TestCase):
@@ -36,18 +37,15 @@ class TestLoadOmni(unittest.TestCase):
                  'dens': array([ 12.5,  12.5,  12.5,  12.5,  12.5,  12.5]),
                  'dst': array([-57., -57., -57., -57., -57., -57.]),
                  'pdyn': array([ 9.3,  9.3,  9.3,  9.3,  9.3,  9.3]),
-                 'time': array([dt.datetime(2000, 7, 14, 12, 0),
-                                dt.datetime(2000, 7, 14, 13, 0),
-                                dt.datetime(2000, 7, 14, 16, 0),
-                                dt.datetime(2000, 7, 14, 18, 0),
-                                dt.datetime(2000, 7, 15, 13, 0),
-                                dt.datetime(2000, 7, 15, 14, 0)],
-                               dtype=object),
+                 'time': array(['2000-07-14T12', '2000-07-14T13',
+                                '2000-07-14T16', '2000-07-14T18',
+                                '2000-07-15T13', '2000-07-15T14'],
+                               dtype='datetime64[h]'),
                  'v': array([ 610.,  610.,  610.,  610.,  610.,  610.])}
 
     knownRecord = {'b':7.4, 'bx':4.4, 'by':5.7, 'bz':-1.7,
                    'dens':3.3, 'v':478.0, 'pdyn':1.58, 'dst':-61.0,
-                   'time':dt.datetime(2000,7,20,23,0,0)}
+                   'time':datetime64('2000-07-20T23')}
 
     def testReadSimple(self):
         data = precond2.load_omni('data/omni_test.lst')
@@ -59,6 +57,27 @@ class TestLoadOmni(unittest.TestCase):
         for k in self.knownRecord:
             self.assertEqual(self.knownRecord[k], data[k][-1])
             
+    def testReadStop(self):
+        full = precond2.load_omni('data/omni_july2000.lst')
+        for t in ['2000-07-10T00', '2000-07-15T13', '2000-07-15T13:30',
+                  '2000-07-20T23', '2000-07-25T00']:
+            data = precond2.load_omni('data/omni_july2000.lst',
+                                      stop=datetime64(t))
+            keep = full['time'] <= datetime64(t)
+            for k in ['time'] + precond2.varnames:
+                assert_array_equal(full[k][keep], data[k])
+
+    def testReadStopBefore(self):
+        data = precond2.load_omni('data/omni_test.lst',
+                                  stop=dt.datetime(2000,7,1,0,0,0))
+        self.assertEqual(0, data.size)
+
+    def testReadEmpty(self):
+        with tempfile.NamedTemporaryFile(suffix='.lst') as f:
+            data = precond2.load_omni(f.name)
+        self.assertEqual(0, data.size)
+        self.assertEqual(precond2.omni_dtype, data.dtype)
+
 class TestClock(unittest.TestCase):
     knownClock = array([  90.,    0.,  -90.,  180.,   45.,   45.])
 
@@ -67,6 +86,24 @@ class TestClock(unittest.TestCase):
         precond2.calc_clock(data)
         assert_array_equal(self.knownClock, data['clock'])
 
+class TestWindowedMeans(unittest.TestCase):
+    knownMeans = array([3.5, 1.0, 0.25, 0.0, 12.5, 610.0, 9.3, -57.0])
+
+    def testWindow(self):
+        data = precond2.load_omni('data/omni_test.lst')
+        tEnd = datetime64('2000-07-15T13')
+        values = array([data[v] for v in precond2.varnames])
+        means = precond2.windowed_means(values, data['time'],
+                                        tEnd-timedelta64(24,'h'), tEnd)
+        assert_array_equal(self.knownMeans, means)
+
+    def testSingle(self):
+        data = precond2.load_omni('data/omni_test.lst')
+        tEnd = datetime64('2000-07-15T13')
+        mean = precond2.windowed_means(data['b'], data['time'],
+                                       tEnd-timedelta64(24,'h'), tEnd)
+        self.assertEqual(3.5, mean)
+
 class TestPrecond(unittest.TestCase):
     knownMeans = {'b': 3.5,
                   'bx': 1.0,
@@ -87,5 +124,47 @@ class TestPrecond(unittest.TestCase):
         for m in self.knownMeans:
             self.assertEqual(self.knownMeans[m], means[m])
         
+class TestPreconds(unittest.TestCase):
+    epochs = [dt.datetime(2000,7,12,0,0,0),
+              dt.datetime(2000,7,15,13,0,0),
+              dt.datetime(2000,7,14,13,0,0),
+              dt.datetime(2000,7,20,23,0,0),
+              dt.datetime(2000,7,21,12,0,0),
+              dt.datetime(2000,7,21,23,0,0),
+              dt.datetime(2000,7,10,5,0,0)]
+
+    def testMatchesSingle(self):
+        filename = 'data/omni_july2000.lst'
+        means = precond2.get_preconds(filename, self.epochs)
+        for i, t in enumerate(self.epochs):
+            single = precond2.get_precond(filename, t)
+            for m in single:
+                assert_allclose(single[m], means[m][i])
+
+    def testEmpty(self):
+        means = precond2.get_preconds('data/omni_test.lst',
+                                      [dt.datetime(2001,1,1,0,0,0)])
+        self.assertTrue(isnan(means['b'][0]))
+
+    def testEmptyBefore(self):
+        means = precond2.get_preconds('data/omni_july2000.lst',
+                                      [dt.datetime(1999,1,1,0,0,0),
+                                       dt.datetime(1999,6,1,0,0,0)])
+        for m in means:
+            self.assertEqual((2,), means[m].shape)
+            self.assertTrue(isnan(means[m]).all())
+
+    def testNoEpochs(self):
+        means = precond2.get_preconds('data/omni_test.lst', [])
+        self.assertEqual(precond2.fieldnames, list(means))
+        for m in means:
+            self.assertEqual((0,), means[m].shape)
+
+    def testNaT(self):
+        with self.assertRaises(ValueError):
+            precond2.get_preconds('data/omni_test.lst',
+                                  [dt.datetime(2000,7,15,13,0,0),
+                                   datetime64('NaT')])
+
 if __name__ == '__main__':
     unittest.main()